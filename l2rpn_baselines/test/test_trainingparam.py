@@ -8,9 +8,16 @@
 
 # test that the baselines can be imported
 import os
+import sys
+import json
+import pickle
 import unittest
+import unittest.mock
 import tempfile
+import importlib.util
+import numpy as np
 from l2rpn_baselines.utils import TrainingParam
+from l2rpn_baselines.utils.TrainingParam import _epsilon_kernel, get_epsilon_kernel
 import pdb
 
 
@@ -28,6 +35,65 @@ class TestTrainingParam(unittest.TestCase):
         tp2 = TrainingParam.from_json(os.path.join(tmp_dir, "test.json"))
         assert tp2 == tp
 
+    def test_loadback_pickle(self):
+        tp = TrainingParam(buffer_size=123, epsilon_schedule="linear")
+        tmp_dir = tempfile.mkdtemp()
+        tp.save_as_pickle(tmp_dir, "test.pkl")
+        tp2 = TrainingParam.from_pickle(os.path.join(tmp_dir, "test.pkl"))
+        assert tp2 == tp
+        tp.save_as_pickle(tmp_dir)
+        tp3 = TrainingParam.from_pickle(os.path.join(tmp_dir, "training_parameters.pkl"))
+        assert tp3 == tp
+
+    def test_wrong_paths(self):
+        tp = TrainingParam()
+        tmp_dir = tempfile.mkdtemp()
+        with self.assertRaises(RuntimeError):
+            tp.save_as_json(os.path.join(tmp_dir, "not_a_dir"), "test.json")
+        tp.save_as_json(tmp_dir, "test.json")
+        with self.assertRaises(NotADirectoryError):
+            tp.save_as_json(os.path.join(tmp_dir, "test.json"), "test.json")
+        with self.assertRaises(FileNotFoundError):
+            TrainingParam.from_json(os.path.join(tmp_dir, "not_a_file.json"))
+        with self.assertRaises(FileNotFoundError):
+            TrainingParam.from_pickle(os.path.join(tmp_dir, "not_a_file.pkl"))
+
+    def test_json_readable(self):
+        tp = TrainingParam()
+        tmp_dir = tempfile.mkdtemp()
+        tp.save_as_json(tmp_dir, "test.json")
+        with open(os.path.join(tmp_dir, "test.json"), "r", encoding="utf-8") as f:
+            dict_ = json.load(f)
+        assert dict_ == tp.to_dict()
+
+    def test_loadback_non_finite(self):
+        tp_module = sys.modules[TrainingParam.__module__]
+        backends = [False]
+        if importlib.util.find_spec("orjson") is not None:
+            backends.append(True)
+        for use_orjson in backends:
+            with unittest.mock.patch.object(tp_module, "_CAN_USE_ORJSON", use_orjson):
+                tp = TrainingParam(max_loss=float("inf"), max_value_grad=float("nan"))
+                tmp_dir = tempfile.mkdtemp()
+                tp.save_as_json(tmp_dir, "test.json")
+                tp2 = TrainingParam.from_json(os.path.join(tmp_dir, "test.json"))
+                assert tp2.max_loss == float("inf"), "error when using orjson: {}".format(use_orjson)
+                assert np.isnan(tp2.max_value_grad), "error when using orjson: {}".format(use_orjson)
+
+    def test_loadback_after_overwrite(self):
+        tp = TrainingParam()
+        tmp_dir = tempfile.mkdtemp()
+        path_json = os.path.join(tmp_dir, "test.json")
+        tp.save_as_json(tmp_dir, "test.json")
+        tp2 = TrainingParam.from_json(path_json)
+        assert tp2 == tp
+        # the same file is modified, it must be read again
+        tp.buffer_size = 123456
+        tp.save_as_json(tmp_dir, "test.json")
+        tp3 = TrainingParam.from_json(path_json)
+        assert tp3 == tp
+        assert tp3.buffer_size == 123456
+
     def test_loadback_modified(self):
         for el in TrainingParam._int_attr:
             self._aux_test_attr(el, 1)
@@ -61,6 +127,124 @@ class TestTrainingParam(unittest.TestCase):
         eps = tp.get_next_epsilon(1)
         assert eps == 0.01
 
+    def test_epsilon_decay(self):
+        tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000)
+        assert abs(tp.get_next_epsilon(0) - 0.4) <= 1e-8
+        assert abs(tp.get_next_epsilon(1000) - 0.01) <= 1e-8
+        assert tp.get_next_epsilon(1001) == 0.01
+        # changing the number of steps must be taken into account
+        tp.step_for_final_epsilon = 500
+        assert abs(tp.get_next_epsilon(500) - 0.01) <= 1e-8
+        tp.step_for_final_epsilon = None
+        assert tp.get_next_epsilon(1) == 0.
+
+    def test_epsilon_kernel(self):
+        tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000)
+        for step in [0, 10, 999, 1000, 1001, 5000]:
+            eps = _epsilon_kernel(step, tp.step_for_final_epsilon, tp.initial_epsilon, tp.final_epsilon,
+                                  tp._decay_coef)
+            assert abs(eps - tp.get_next_epsilon(step)) <= 1e-8
+
+    @unittest.skipIf(importlib.util.find_spec("numba") is None, "numba is not installed")
+    def test_epsilon_kernel_numba(self):
+        tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000)
+        kernel = get_epsilon_kernel()
+        assert get_epsilon_kernel() is kernel
+        for step in [0, 10, 999, 1000, 1001, 5000]:
+            eps = kernel(step, tp.step_for_final_epsilon, tp.initial_epsilon, tp.final_epsilon, tp._decay_coef)
+            assert abs(eps - tp.get_next_epsilon(step)) <= 1e-8
+
+    def test_get_epsilons(self):
+        tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000)
+        steps = np.arange(0, 1500, 7)
+        epsilons = tp.get_epsilons(steps)
+        assert epsilons.shape == steps.shape
+        for step, eps in zip(steps, epsilons):
+            assert abs(tp.get_next_epsilon(step) - eps) <= 1e-8
+        # scalar input
+        assert abs(tp.get_epsilons(5) - tp.get_next_epsilon(5)) <= 1e-8
+        # negative steps
+        for step in [-10, -1]:
+            assert abs(tp.get_epsilons(step) - tp.get_next_epsilon(step)) <= 1e-8
+            assert abs(tp.get_epsilons([step])[0] - tp.get_next_epsilon(step)) <= 1e-8
+        tp.final_epsilon = None
+        assert np.all(tp.get_epsilons(steps) == 0.)
+
+    def test_epsilon_schedules(self):
+        steps = np.arange(0, 1500, 7)
+        for schedule in ["exp", "inv", "linear", "sin"]:
+            tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000,
+                               epsilon_schedule=schedule)
+            assert abs(tp.get_next_epsilon(0) - 0.4) <= 1e-8, "error for schedule {}".format(schedule)
+            epsilons = tp.get_epsilons(steps)
+            for step, eps in zip(steps, epsilons):
+                assert abs(tp.get_next_epsilon(step) - eps) <= 1e-8, "error for schedule {}".format(schedule)
+            assert abs(tp.get_epsilons(5) - tp.get_next_epsilon(5)) <= 1e-8, "error for schedule {}".format(schedule)
+            # epsilon is decreasing
+            assert np.all(np.diff(epsilons) <= 1e-8), "error for schedule {}".format(schedule)
+            if schedule != "inv":
+                assert abs(tp.get_next_epsilon(1000) - 0.01) <= 1e-8, "error for schedule {}".format(schedule)
+                assert tp.get_next_epsilon(1001) == 0.01, "error for schedule {}".format(schedule)
+
+            # the schedule is saved
+            tmp_dir = tempfile.mkdtemp()
+            tp.save_as_json(tmp_dir, "test.json")
+            tp2 = TrainingParam.from_json(os.path.join(tmp_dir, "test.json"))
+            assert tp2 == tp
+            assert tp2.epsilon_schedule == schedule
+        with self.assertRaises(RuntimeError):
+            TrainingParam(epsilon_schedule="unknown")
+
+    def test_pickle_instance(self):
+        steps = np.arange(0, 1500, 7)
+        for schedule in ["exp", "inv", "linear", "sin"]:
+            tp = TrainingParam(initial_epsilon=0.4, final_epsilon=0.01, step_for_final_epsilon=1000,
+                               epsilon_schedule=schedule)
+            tp.tell_step(12)
+            tp2 = pickle.loads(pickle.dumps(tp))
+            assert tp2 == tp, "error for schedule {}".format(schedule)
+            assert tp2.last_step == 12, "error for schedule {}".format(schedule)
+            assert np.all(tp2.get_epsilons(steps) == tp.get_epsilons(steps)), "error for schedule {}".format(schedule)
+            assert tp2.max_iter_fun.__self__ is tp2, "error for schedule {}".format(schedule)
+        tp = TrainingParam()
+        tp.final_epsilon = None
+        tp2 = pickle.loads(pickle.dumps(tp))
+        assert tp2 == tp
+        assert tp2.get_next_epsilon(1) == 0.
+
+    def test_do_train(self):
+        for update_freq in [1, 3, 256, 100]:
+            tp = TrainingParam(update_freq=update_freq)
+            for step in range(1000):
+                tp.tell_step(step)
+                assert tp.do_train() == (step % update_freq == 0), "error for update_freq {}".format(update_freq)
+        tp.update_freq = 7
+        tp.tell_step(14)
+        assert tp.do_train()
+        tp.tell_step(16)
+        assert not tp.do_train()
+        # steps that are not python integers
+        tp = TrainingParam(update_freq=256)
+        for step in [256.0, np.float64(256), np.int64(256), np.int32(512)]:
+            tp.tell_step(step)
+            assert tp.do_train(), "error for step {} ({})".format(step, type(step))
+        for step in [255.0, np.float64(257), np.int64(255)]:
+            tp.tell_step(step)
+            assert not tp.do_train(), "error for step {} ({})".format(step, type(step))
+
+    def test_step_and_should_train(self):
+        for update_freq in [3, 256]:
+            tp = TrainingParam(update_freq=update_freq)
+            for step in range(1000):
+                should_train = tp.step_and_should_train(step)
+                assert tp.last_step == step
+                assert should_train == tp.do_train(), "error for update_freq {}".format(update_freq)
+        tp = TrainingParam(update_freq=256)
+        for step in [256.0, np.float64(256), np.int64(256), 255.0, np.float64(257), np.int64(255)]:
+            should_train = tp.step_and_should_train(step)
+            assert should_train == (step % 256 == 0), "error for step {} ({})".format(step, type(step))
+            assert should_train == tp.do_train(), "error for step {} ({})".format(step, type(step))
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
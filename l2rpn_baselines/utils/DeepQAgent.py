@@ -608,9 +608,9 @@ class DeepQAgent(AgentWithConverter):
 
     def _train_model(self, training_step):
         """train the deep q networks."""
-        self._training_param.tell_step(training_step)
+        should_train = self._training_param.step_and_should_train(training_step)
         if training_step > max(self._training_param.min_observation, self._training_param.minibatch_size) and \
-            self._training_param.do_train():
+            should_train:
             # train the model
             s_batch, a_batch, r_batch, d_batch, s2_batch = self.replay_buffer.sample(self._training_param.minibatch_size)
             tf_writer = None
@@ -6,9 +6,67 @@
 # SPDX-License-Identifier: MPL-2.0
 # This file is part of L2RPN Baselines, L2RPN Baselines a repository to host baselines for l2rpn competitions.
 import os
+import stat
 import json
+import pickle
+import math
+import operator
+import functools
 import numpy as np
 
+try:
+    # faster reading of the json, but not mandatory
+    import orjson
+    _CAN_USE_ORJSON = True
+except ImportError:
+    _CAN_USE_ORJSON = False
+
+
+def _epsilon_kernel(step, step_for_final_epsilon, initial_epsilon, final_epsilon, decay_coef):
+    """
+    exponential decrease of the epsilon for the e greedy exploration. See :func:`TrainingParam.get_next_epsilon`
+    and :func:`get_epsilon_kernel` for a version that can be called from numba "nopython" code.
+    """
+    if step > step_for_final_epsilon:
+        return final_epsilon
+    return initial_epsilon * math.exp(-step * decay_coef)
+
+
+_epsilon_kernel_jit = None
+
+
+def get_epsilon_kernel():
+    """
+    return the function computing the exponential decrease of the epsilon compiled with numba, so that it can
+    be called from numba "nopython" code. Numba is imported (and the function is compiled) only the first time this
+    is called, it raises an ``ImportError`` if numba is not installed.
+    """
+    global _epsilon_kernel_jit
+    if _epsilon_kernel_jit is None:
+        try:
+            from numba import njit
+        except ImportError as exc_:
+            raise ImportError("numba is required to use the compiled epsilon kernel") from exc_
+        _epsilon_kernel_jit = njit(cache=True, fastmath=True)(_epsilon_kernel)
+    return _epsilon_kernel_jit
+
+
+@functools.lru_cache(maxsize=32)
+def _load_dict(abspath, mtime_ns, size):
+    """
+    read the json located at `abspath`. The modification time and the size of the file are part of the key of the
+    cache, so that a file modified on the hard drive is read again. The returned dictionnary should not be modified.
+    """
+    with open(abspath, "rb") as f:
+        content = f.read()
+    if _CAN_USE_ORJSON:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # orjson does not support "Infinity" or "NaN" (written by the json module for non finite floats)
+            pass
+    return json.loads(content.decode("utf-8"))
+
 
 class TrainingParam(object):
     """
@@ -33,6 +91,12 @@ class TrainingParam(object):
     step_for_final_epsilon: ``int``
         number of step at which the final epsilon (for the epsilon greedy exploration) will be reached
 
+    epsilon_schedule: ``str``
+        How the epsilon decreases from `initial_epsilon` to `final_epsilon`. One of "exp" (exponential decay, the
+        default), "linear" (linear decay), "sin" (half a cosine period) or "inv" (`final_epsilon +
+        (initial_epsilon - final_epsilon) / (1 + step / step_for_final_epsilon)`, for this last schedule
+        the final epsilon is only reached asymptotically).
+
     min_observation: ``int``
         number of observations before starting to train the neural nets. Before this number of iterations, the agent
         will simply interact with the environment.
@@ -120,6 +184,19 @@ class TrainingParam(object):
     _float_attr = ["_final_epsilon", "_initial_epsilon", "lr", "lr_decay_steps", "lr_decay_rate",
                     "discount_factor", "tau", "oversampling_rate",
                    "max_global_norm_grad", "max_value_grad", "max_loss"]
+    _epsilon_schedules = ("exp", "inv", "linear", "sin")
+    # retrieve all the values at once (used for the serialization)
+    _int_get = operator.attrgetter(*_int_attr)
+    _float_get = operator.attrgetter(*_float_attr)
+
+    # all the attributes are known in advance, this saves memory and speeds up the attribute access
+    __slots__ = ("random_sample_datetime_start", "buffer_size", "minibatch_size", "min_observation",
+                 "_final_epsilon", "_initial_epsilon", "_step_for_final_epsilon", "lr", "lr_decay_steps",
+                 "lr_decay_rate", "max_global_norm_grad", "max_value_grad", "max_loss", "last_step", "num_frames",
+                 "discount_factor", "tau", "_update_freq", "min_iter", "max_iter", "_1_update_nb_iter",
+                 "_update_nb_iter", "step_increase_nb_iter", "oversampling_rate", "update_tensorboard_freq",
+                 "save_model_each", "max_iter_fun", "_exp_facto", "_decay_coef",
+                 "_epsilon_schedule", "_epsilon_fn", "_epsilons_fn")
 
     def __init__(self,
                  buffer_size=40000,
@@ -145,7 +222,8 @@ class TrainingParam(object):
                  oversampling_rate=None,
                  max_global_norm_grad=None,
                  max_value_grad=None,
-                 max_loss=None
+                 max_loss=None,
+                 epsilon_schedule="exp"
                  ):
 
         self.random_sample_datetime_start = random_sample_datetime_start
@@ -155,7 +233,9 @@ class TrainingParam(object):
         self.min_observation = int(min_observation)
         self._final_epsilon = float(final_epsilon)  # have on average 1 random action per day of approx 288 timesteps at the end (never kill completely the exploration)
         self._initial_epsilon = float(initial_epsilon)
-        self.step_for_final_epsilon = float(step_for_final_epsilon)
+        self._step_for_final_epsilon = int(step_for_final_epsilon)
+        self._check_epsilon_schedule(epsilon_schedule)
+        self._epsilon_schedule = epsilon_schedule
         self.lr = float(lr)
         self.lr_decay_steps = float(lr_decay_steps)
         self.lr_decay_rate = float(lr_decay_rate)
@@ -169,7 +249,7 @@ class TrainingParam(object):
         self.num_frames = int(num_frames)
         self.discount_factor = float(discount_factor)
         self.tau = float(tau)
-        self.update_freq = int(update_freq)
+        self._update_freq = int(update_freq)
         self.min_iter = int(min_iter)
         self.max_iter = int(max_iter)
         self._1_update_nb_iter = None
@@ -177,17 +257,17 @@ class TrainingParam(object):
         if step_increase_nb_iter is None:
             # 0 and None have the same effect: it disable the feature
             step_increase_nb_iter = 0
-        self.step_increase_nb_iter = step_increase_nb_iter
+        self.step_increase_nb_iter = int(step_increase_nb_iter)
 
         if oversampling_rate is not None:
             self.oversampling_rate = float(oversampling_rate)
         else:
             self.oversampling_rate = None
 
-        self.update_tensorboard_freq = update_tensorboard_freq
-        self.save_model_each = save_model_each
+        self.update_tensorboard_freq = self._to_int(update_tensorboard_freq)
+        self.save_model_each = self._to_int(save_model_each)
         self.max_iter_fun = self.default_max_iter_fun
-        self._compute_exp_facto()
+        self._recompute_decay()
 
     @property
     def final_epsilon(self):
@@ -196,7 +276,7 @@ class TrainingParam(object):
     @final_epsilon.setter
     def final_epsilon(self, final_epsilon):
         self._final_epsilon = final_epsilon
-        self._compute_exp_facto()
+        self._recompute_decay()
 
     @property
     def initial_epsilon(self):
@@ -205,7 +285,34 @@ class TrainingParam(object):
     @initial_epsilon.setter
     def initial_epsilon(self, initial_epsilon):
         self._initial_epsilon = initial_epsilon
-        self._compute_exp_facto()
+        self._recompute_decay()
+
+    @property
+    def step_for_final_epsilon(self):
+        return self._step_for_final_epsilon
+
+    @step_for_final_epsilon.setter
+    def step_for_final_epsilon(self, step_for_final_epsilon):
+        self._step_for_final_epsilon = step_for_final_epsilon
+        self._recompute_decay()
+
+    @property
+    def epsilon_schedule(self):
+        return self._epsilon_schedule
+
+    @epsilon_schedule.setter
+    def epsilon_schedule(self, epsilon_schedule):
+        self._check_epsilon_schedule(epsilon_schedule)
+        self._epsilon_schedule = epsilon_schedule
+        self._build_epsilon_fn()
+
+    @property
+    def update_freq(self):
+        return self._update_freq
+
+    @update_freq.setter
+    def update_freq(self, update_freq):
+        self._update_freq = update_freq
 
     @property
     def update_nb_iter(self):
@@ -219,12 +326,96 @@ class TrainingParam(object):
         else:
             self._1_update_nb_iter = 1.0
 
-    def _compute_exp_facto(self):
-        if self.final_epsilon is not None and self.initial_epsilon is not None and self.final_epsilon > 0:
-            self._exp_facto = np.log(self.initial_epsilon/self.final_epsilon)
+    def _recompute_decay(self):
+        """update all the cached values used to compute the epsilon, must be called when one of them changes"""
+        if self.final_epsilon is not None and self.initial_epsilon is not None and \
+                self.final_epsilon > 0 and self.initial_epsilon > 0:
+            self._exp_facto = math.log(self.initial_epsilon / self.final_epsilon)
         else:
             # TODO
-            self._exp_facto = 1
+            self._exp_facto = 1.0
+
+        # cache the decay coefficient to avoid a division at each call to "get_next_epsilon"
+        if self.step_for_final_epsilon is None or self.initial_epsilon is None or self.final_epsilon is None:
+            self._decay_coef = None
+        elif self.step_for_final_epsilon > 0:
+            self._decay_coef = self._exp_facto / self.step_for_final_epsilon
+        else:
+            self._decay_coef = 0.
+        self._build_epsilon_fn()
+
+    def _check_epsilon_schedule(self, epsilon_schedule):
+        if epsilon_schedule not in self._epsilon_schedules:
+            raise RuntimeError("Unknown epsilon schedule \"{}\". It should be one of {}"
+                               "".format(epsilon_schedule, self._epsilon_schedules))
+
+    def _build_epsilon_fn(self):
+        """
+        choose once the functions used to compute the epsilon (for one step in `_epsilon_fn` and for an array of
+        steps in `_epsilons_fn`). All the constants are stored in the closures.
+        """
+        if self._decay_coef is None:
+            self._epsilon_fn = lambda step: 0.
+            self._epsilons_fn = lambda steps: np.zeros(steps.shape, dtype=np.float64)
+            return
+
+        e0 = self.initial_epsilon
+        ef = self.final_epsilon
+        nb_steps = self.step_for_final_epsilon
+        if self.epsilon_schedule == "exp":
+            decay_coef = self._decay_coef
+
+            def epsilon_fn(step):
+                return _epsilon_kernel(step, nb_steps, e0, ef, decay_coef)
+
+            def epsilons_fn(steps):
+                return np.where(steps > nb_steps, ef, e0 * np.exp(-steps * decay_coef))
+        elif nb_steps <= 0:
+            # final epsilon is reached immediately
+            def epsilon_fn(step):
+                return ef if step > 0 else e0
+
+            def epsilons_fn(steps):
+                return np.where(steps > 0, ef, e0)
+        elif self.epsilon_schedule == "inv":
+            inv_nb_steps = 1.0 / nb_steps
+            delta = e0 - ef
+
+            def epsilon_fn(step):
+                return ef + delta / (1. + step * inv_nb_steps)
+
+            def epsilons_fn(steps):
+                return ef + delta / (1. + steps * inv_nb_steps)
+        elif self.epsilon_schedule == "linear":
+            slope = (e0 - ef) / nb_steps
+
+            def epsilon_fn(step):
+                return ef if step > nb_steps else e0 - step * slope
+
+            def epsilons_fn(steps):
+                return np.where(steps > nb_steps, ef, e0 - steps * slope)
+        else:
+            # "sin" schedule
+            half_delta = 0.5 * (e0 - ef)
+            pulsation = math.pi / nb_steps
+
+            def epsilon_fn(step):
+                return ef if step > nb_steps else ef + half_delta * (1. + math.cos(step * pulsation))
+
+            def epsilons_fn(steps):
+                return np.where(steps > nb_steps, ef, ef + half_delta * (1. + np.cos(steps * pulsation)))
+        self._epsilon_fn = epsilon_fn
+        self._epsilons_fn = epsilons_fn
+
+    def __getstate__(self):
+        # the functions computing the epsilon are closures that cannot be pickled, they are built again when loaded
+        return {nm: getattr(self, nm) for nm in self.__slots__
+                if nm not in ("_epsilon_fn", "_epsilons_fn") and hasattr(self, nm)}
+
+    def __setstate__(self, state):
+        for nm, val in state.items():
+            setattr(self, nm, val)
+        self._recompute_decay()
 
     def default_max_iter_fun(self, nb_success):
         """the default max iteration function used"""
@@ -236,33 +427,32 @@ class TrainingParam(object):
 
     def get_next_epsilon(self, current_step):
         """get the next epsilon for the e greedy exploration"""
-        self.tell_step(current_step)
-        if self.step_for_final_epsilon is None or self.initial_epsilon is None \
-                or self._exp_facto is None or self.final_epsilon is None:
-            res = 0.
-        else:
-            if current_step > self.step_for_final_epsilon:
-                res = self.final_epsilon
-            else:
-                # exponential decrease
-                res = self.initial_epsilon * np.exp(- (current_step / self.step_for_final_epsilon) * self._exp_facto )
-        return res
+        self.last_step = current_step
+        return self._epsilon_fn(current_step)
+
+    def get_epsilons(self, steps):
+        """
+        get the epsilons for the e greedy exploration for all the training steps in `steps` at once (for example
+        to plot the exploration schedule). Contrary to :func:`TrainingParam.get_next_epsilon` this does not
+        change the `last_step` attribute.
+        """
+        return self._epsilons_fn(np.asarray(steps, dtype=np.float64))
+
+    @staticmethod
+    def _to_int(val):
+        return int(val) if val is not None else None
+
+    @staticmethod
+    def _to_float(val):
+        return float(val) if val is not None else None
 
     def to_dict(self):
         """serialize this instance to a dictionnary."""
-        res = {}
-        for attr_nm in self._int_attr:
-            tmp = getattr(self, attr_nm)
-            if tmp is not None:
-                res[attr_nm] = int(tmp)
-            else:
-                res[attr_nm] = None
-        for attr_nm in self._float_attr:
-            tmp = getattr(self, attr_nm)
-            if tmp is not None:
-                res[attr_nm] = float(tmp)
-            else:
-                res[attr_nm] = None
+        # values are already typed in __init__, the conversion is kept for attributes modified afterwards
+        # (for example with numpy scalars that cannot be serialized to json)
+        res = dict(zip(self._int_attr, map(self._to_int, self._int_get(self))))
+        res.update(zip(self._float_attr, map(self._to_float, self._float_get(self))))
+        res["epsilon_schedule"] = self.epsilon_schedule
         return res
 
     @staticmethod
@@ -273,49 +463,82 @@ class TrainingParam(object):
         res = TrainingParam()
         for attr_nm in TrainingParam._int_attr:
             if attr_nm in tmp:
-                tmp_ = tmp[attr_nm]
-                if tmp_ is not None:
-                    setattr(res, attr_nm, int(tmp_))
-                else:
-                    setattr(res, attr_nm, None)
+                setattr(res, attr_nm, TrainingParam._to_int(tmp[attr_nm]))
 
         for attr_nm in TrainingParam._float_attr:
             if attr_nm in tmp:
-                tmp_ = tmp[attr_nm]
-                if tmp_ is not None:
-                    setattr(res, attr_nm, float(tmp_))
-                else:
-                    setattr(res, attr_nm, None)
+                setattr(res, attr_nm, TrainingParam._to_float(tmp[attr_nm]))
+
+        if "epsilon_schedule" in tmp:
+            # not present in files saved with older versions
+            res.epsilon_schedule = tmp["epsilon_schedule"]
         res.update_nb_iter = res._update_nb_iter
-        res.initial_epsilon = res._initial_epsilon
-        res._compute_exp_facto()
+        res._recompute_decay()
         return res
 
     @staticmethod
     def from_json(json_path):
         """initialize this instance from a json"""
-        if not os.path.exists(json_path):
-            raise FileNotFoundError("No path are located at \"{}\"".format(json_path))
-        with open(json_path, "r") as f:
-            dict_ = json.load(f)
-        return TrainingParam.from_dict(dict_)
+        try:
+            stat_ = os.stat(json_path)
+        except FileNotFoundError as exc_:
+            raise FileNotFoundError("No path are located at \"{}\"".format(json_path)) from exc_
+        dict_ = _load_dict(os.path.abspath(json_path), stat_.st_mtime_ns, stat_.st_size)
+        # do not let anything modify the cached dictionnary
+        return TrainingParam.from_dict(dict(dict_))
 
     def save_as_json(self, path, name=None):
         """save this instance as a json"""
         res = self.to_dict()
         if name is None:
             name = "training_parameters.json"
-        if not os.path.exists(path):
-            raise RuntimeError("Directory \"{}\" not found to save the training parameters".format(path))
-        if not os.path.isdir(path):
-            raise NotADirectoryError("\"{}\" should be a directory".format(path))
+        self._check_save_dir(path)
         path_out = os.path.join(path, name)
+        # json module is used to write the file: orjson would replace "inf" and "nan" with "null"
         with open(path_out, "w", encoding="utf-8") as f:
             json.dump(res, fp=f, indent=4, sort_keys=True)
 
+    @staticmethod
+    def from_pickle(pickle_path):
+        """initialize this instance from a file saved with :func:`TrainingParam.save_as_pickle`"""
+        try:
+            with open(pickle_path, "rb") as f:
+                dict_ = pickle.load(f)
+        except FileNotFoundError as exc_:
+            raise FileNotFoundError("No path are located at \"{}\"".format(pickle_path)) from exc_
+        return TrainingParam.from_dict(dict_)
+
+    def save_as_pickle(self, path, name=None):
+        """
+        save this instance with pickle. This is faster to reload than a json (for example for training checkpoints)
+        but not human readable: json remains the reference format.
+        """
+        res = self.to_dict()
+        if name is None:
+            name = "training_parameters.pkl"
+        self._check_save_dir(path)
+        path_out = os.path.join(path, name)
+        with open(path_out, "wb") as f:
+            pickle.dump(res, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _check_save_dir(path):
+        # only one system call (instead of "os.path.exists" then "os.path.isdir")
+        try:
+            stat_ = os.stat(path)
+        except FileNotFoundError as exc_:
+            raise RuntimeError("Directory \"{}\" not found to save the training parameters".format(path)) from exc_
+        if not stat.S_ISDIR(stat_.st_mode):
+            raise NotADirectoryError("\"{}\" should be a directory".format(path))
+
     def do_train(self):
         """return whether or not i should train the model at this time step"""
-        return self.last_step % self.update_freq == 0
+        return self.last_step % self._update_freq == 0
+
+    def step_and_should_train(self, current_step):
+        """same as calling :func:`TrainingParam.tell_step` and then :func:`TrainingParam.do_train`"""
+        self.last_step = current_step
+        return current_step % self._update_freq == 0
 
     def __eq__(self, other):
         res = True
@@ -348,4 +571,7 @@ class TrainingParam(object):
                 if abs(float(me_) - float(oth_)) > self._tol_float_equal:
                     res = False
                     break
+        if res:
+            res = self.epsilon_schedule == other.epsilon_schedule
         return res
+